@@ -0,0 +1,72 @@
+# This script measures the speedup of the Gram-matrix distance engine
+# (detour.clustering.gram_pdist) over scipy.spatial.distance.pdist on
+# random feature matrices with the width of DETOUR's curvature based
+# features (2 * road_section_count + 1 columns), and checks that both
+# agree within detour.clustering.GRAM_PDIST_TOLERANCE. Besides standard
+# normal data, it uses data with near-duplicate rows and data with a large
+# offset, where rounding errors of the Gram-matrix identity are largest.
+# The script exits with a non-zero status if the tolerance is exceeded.
+
+import argparse
+import sys
+import time
+
+import numpy as np
+from scipy.spatial.distance import pdist
+
+from detour.clustering import gram_pdist, GRAM_PDIST_TOLERANCE
+
+
+def best_time(function, repeat_count):
+    """Return the best wall-clock time of repeat_count calls of function."""
+    times = []
+    for _ in range(repeat_count):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+def make_data(kind, road_count, feature_count, random_generator):
+    """Return a road_count x feature_count data matrix of the given kind:
+    'normal' (standard normal), 'near-duplicate' (half of the rows are
+    copies of the other half perturbed by 1e-7) or 'offset' (standard
+    normal shifted by 1e4)."""
+    data = random_generator.normal(size=(road_count, feature_count))
+    if kind == 'near-duplicate':
+        half = road_count // 2
+        data[half:2 * half] = data[:half] + 1e-7 * random_generator.normal(size=(half, feature_count))
+    elif kind == 'offset':
+        data += 1e4
+    return data
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of pairwise distance engines")
+    parser.add_argument("--road-counts", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    parser.add_argument("--road_section-count", type=int, default=6)
+    parser.add_argument("--thread-count", type=int, default=None)
+    parser.add_argument("--repeat-count", type=int, default=3)
+    args = parser.parse_args()
+
+    random_generator = np.random.default_rng(0)
+    failed = False
+    print(f"{'data':>15} {'roads':>8} {'pdist [s]':>10} {'gram [s]':>10} {'speedup':>8} "
+          f"{'max error':>10} {'tolerance':>10}")
+    for kind in ['normal', 'near-duplicate', 'offset']:
+        for road_count in args.road_counts:
+            data = make_data(kind, road_count, 2 * args.road_section_count + 1, random_generator)
+            pdist_seconds = best_time(lambda: pdist(data), args.repeat_count)
+            gram_seconds = best_time(lambda: gram_pdist(data, thread_count=args.thread_count), args.repeat_count)
+            error = np.abs(pdist(data) - gram_pdist(data, thread_count=args.thread_count)).max()
+            tolerance = GRAM_PDIST_TOLERANCE * max(1, np.linalg.norm(data - data.mean(axis=0), axis=1).max())
+            status = "ok"
+            if error > tolerance:
+                status = "FAIL"
+                failed = True
+            print(f"{kind:>15} {road_count:>8} {pdist_seconds:>10.4f} {gram_seconds:>10.4f} "
+                  f"{pdist_seconds / gram_seconds:>8.2f} {error:>10.2e} {tolerance:>10.2e} {status}")
+
+    if failed:
+        sys.exit("gram_pdist does not match pdist within GRAM_PDIST_TOLERANCE")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
+from . import batch
 from . import clustering
 from . import detour
 from . import features
-from . import road
+from . import planning
+from .road import get_roads_from_json_filepath
 
 import argparse
 import json
+import os
+import sys
 
 def setup_parser():
     """Setup function for DETOUR's command line interface argument parser."""
@@ -41,63 +45,158 @@ def setup_parser():
     parser.add_argument("--road_section-count", type=int, default=6,
                         help="Road section count for extracting curvature/arclength features from road test cases.")
 
+    # Pairwise distance computation
+    parser.add_argument("--distance-backend", choices=["pdist", "gram"], default="pdist",
+                        help="Backend for pairwise feature distances: scipy's pdist or the multithreaded BLAS-based Gram-matrix engine.")
+
     # Random seed
     parser.add_argument("--random-seed", type=int, default=0,
                         help="Seed for random operations in DETOUR algorithm.")
 
+    # Batch execution of many suites
+    parser.add_argument("--batch-manifest-filepath", type=str, default=None,
+                        help="Filepath for the json file that lists jobs (suites) to run in batch. When given, the executed/not-executed/output filepaths above are ignored.")
+    parser.add_argument("--batch-report-filepath", type=str, default="batch-report.json",
+                        help="Filepath for the json file that DETOUR outputs with per-job timing after batch execution.")
+    parser.add_argument("--worker-count", type=int, default=None,
+                        help="Number of worker processes for batch execution and parallel feature extraction (defaults to the number of processors).")
+
+    # Planning of memory and time
+    parser.add_argument("--memory-limit", type=float, default=None,
+                        help="Memory limit in MiB used for choosing in-memory or memory-mapped distance storage (defaults to the physical memory or the container's memory limit, whichever is smaller). In batch execution, the limit is shared by the jobs that run at the same time.")
+    parser.add_argument("--plan", "--dry-run", dest="plan", action="store_true",
+                        help="Only print the plan (memory/time estimates and chosen backends) without running DETOUR. In batch execution, the plan of each job is printed.")
+
     return parser
 
-def get_roads_from_json_filepath(json_filepath, is_executed):
-    """This function creates a list of Road objects
-    from roads specified in a json file. The json file has the template
-    [road1_spec, road2_spec, ...] where road1_spec has the template
-    {"meta_data": {"test_info": {"test_outcome": "FAIL"}}
-     "road_points" [{"x": float, "y": float}, ...]} for Failing executed-tests
-    {"meta_data": {"test_info": {"test_outcome": "PASS"}}
-     "road_points" [{"x": float, "y": float}, ...]} for Passing executed-tests
-    {"road_points" [{"x": float, "y": float}, ...]} for not-executed-tests
-    It is allowable to have other keys such as ids and information about
-    test-execution configurations as long as the keys above are provided.
-    The parameter is_executed (True/False) specifies whether the provided
-    json file contains roads that are executed or not-executed. Executed
-    roads (tests) should have the test_outcome.
-     """
-    roads = []
-    with open(json_filepath, 'r') as file:
+# Settings that a batch manifest entry may override, checked against the parser's types and choices
+BATCH_OPTION_NAMES = ["functionality",
+                      "prioritization_ratio",
+                      "selection_min_ratio",
+                      "selection_max_ratio",
+                      "selection_m_closest_neighbor_count",
+                      "selection_w_selection_threshold",
+                      "road_section_count",
+                      "distance_backend",
+                      "random_seed"]
+
+# Filepaths that every batch manifest entry must provide
+BATCH_FILEPATH_NAMES = ["executed_filepath",
+                        "not_executed_filepath",
+                        "output_filepath"]
+
+def check_batch_manifest_entry(entry, parser):
+    """This function checks a batch manifest entry and raises ValueError
+    if it is not a json object, if it lacks one of the filepaths, if it
+    has unknown keys, or if one of its settings does not have the type
+    or is not among the choices of the corresponding command line argument."""
+    if not isinstance(entry, dict):
+        raise ValueError("entry is not a json object")
+    unknown_names = [name for name in entry if name not in BATCH_OPTION_NAMES + BATCH_FILEPATH_NAMES]
+    if len(unknown_names) > 0:
+        raise ValueError(f"unknown keys {unknown_names}")
+    for name in BATCH_FILEPATH_NAMES:
+        if not isinstance(entry.get(name), str):
+            raise ValueError(f"missing or non-string '{name}'")
+
+    actions = {action.dest: action for action in parser._actions}
+    for name in BATCH_OPTION_NAMES:
+        if name not in entry:
+            continue
+        value = entry[name]
+        action = actions[name]
+        if action.type is int:
+            is_valid = isinstance(value, int) and not isinstance(value, bool)
+        elif action.type is float:
+            is_valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            is_valid = isinstance(value, str)
+        if not is_valid:
+            raise ValueError(f"'{name}' has invalid value {value!r}")
+        if action.choices is not None and value not in action.choices:
+            raise ValueError(f"'{name}' has invalid value {value!r} (choose from {list(action.choices)})")
+
+def get_batch_jobs_from_manifest_filepath(manifest_filepath, parser, args):
+    """This function creates a list of jobs for batch.run_batch from
+    a manifest json file with the template [job1_spec, job2_spec, ...]
+    where job1_spec has the template
+    {"executed_filepath": str, "not_executed_filepath": str, "output_filepath": str}
+    and may additionally set any of "functionality", "prioritization_ratio",
+    "selection_min_ratio", "selection_max_ratio", "selection_m_closest_neighbor_count",
+    "selection_w_selection_threshold", "road_section_count", "distance_backend"
+    and "random_seed". Settings that are not given in a job are taken from the command line
+    arguments args. Relative filepaths are relative to the manifest file.
+    An entry that does not pass check_batch_manifest_entry becomes a job
+    with an "error" key, so that it fails without stopping the other jobs."""
+    manifest_dirpath = os.path.dirname(os.path.abspath(manifest_filepath))
+    jobs = []
+    with open(manifest_filepath, 'r') as file:
         data = json.load(file)
-        for entry in data:
-            xvalues = [point["x"] for point in entry["road_points"]]
-            yvalues = [point["y"] for point in entry["road_points"]]
-            if is_executed:
-                is_failing = entry["meta_data"]["test_info"]["test_outcome"] == "FAIL"
-                is_selectable = False
-                road_to_add = road.Road(entry,
-                                        xvalues,
-                                        yvalues,
-                                        is_failing,
-                                        is_selectable)
-            else:
-                is_failing = None
-                is_selectable = True
-                road_to_add = road.Road(entry,
-                                        xvalues,
-                                        yvalues,
-                                        is_failing,
-                                        is_selectable)
-            roads.append(road_to_add)
-
-    return roads
+        for i, entry in enumerate(data):
+            try:
+                check_batch_manifest_entry(entry, parser)
+            except ValueError as exc:
+                output_filepath = None
+                if isinstance(entry, dict) and isinstance(entry.get("output_filepath"), str):
+                    output_filepath = os.path.join(manifest_dirpath, entry["output_filepath"])
+                jobs.append({"output_filepath": output_filepath,
+                             "error": f"invalid manifest entry {i}: {exc}"})
+                continue
+            job = {name: entry.get(name, getattr(args, name)) for name in BATCH_OPTION_NAMES}
+            for name in BATCH_FILEPATH_NAMES:
+                job[name] = os.path.join(manifest_dirpath, entry[name])
+            jobs.append(job)
+
+    return jobs
 
 def main():
     """Main entry point for DETOUR command line tool."""
     parser = setup_parser()
     args = parser.parse_args()
 
+    if args.memory_limit is None:
+        memory_limit_bytes = planning.get_memory_limit_bytes()
+    else:
+        memory_limit_bytes = int(args.memory_limit * 2 ** 20)
+
+    if args.batch_manifest_filepath is not None:
+        jobs = get_batch_jobs_from_manifest_filepath(args.batch_manifest_filepath, parser, args)
+        if args.plan:
+            batch.plan_batch(jobs, args.worker_count, memory_limit_bytes)
+            return
+        report = batch.run_batch(jobs, args.worker_count, memory_limit_bytes)
+        with open(args.batch_report_filepath, 'w') as file:
+            json.dump(report, file, indent=4)
+        if any(["error" in job_report for job_report in report["jobs"]]):
+            sys.exit("Some batch jobs failed, see the batch report.")
+        return
+
     executed_roads = get_roads_from_json_filepath(args.executed_filepath, True)
     not_executed_roads = get_roads_from_json_filepath(args.not_executed_filepath, False)
 
+    selection_count = planning.get_selection_count(executed_roads + not_executed_roads,
+                                                   args.functionality,
+                                                   args.prioritization_ratio,
+                                                   args.selection_max_ratio)
+    plan = planning.make_plan(executed_roads + not_executed_roads,
+                              args.road_section_count,
+                              selection_count,
+                              memory_limit_bytes,
+                              args.worker_count,
+                              args.distance_backend)
+    print(planning.format_plan(plan))
+    if args.plan:
+        return
+    if not plan["fits_in_memory"]:
+        sys.exit("DETOUR is not expected to fit within the memory limit, see the plan above.")
+
     feature_extractor = features.CurvatureBasedRoadFeatureExtractor(args.road_section_count)
-    road_clusterer = clustering.RoadClusterer(feature_extractor)
+    road_clusterer = clustering.RoadClusterer(feature_extractor,
+                                              plan["distance_backend"],
+                                              plan["distance_storage"],
+                                              plan["extraction_worker_count"],
+                                              plan["distance_block_size"],
+                                              plan["distance_thread_count"])
 
     detour_ob = detour.DETOUR(executed_roads, not_executed_roads, road_clusterer, args.random_seed)
 
@@ -114,4 +213,5 @@ def main():
         json.dump(output_data, file, indent=4)
 
 
-main()
+if __name__ == "__main__":
+    main()
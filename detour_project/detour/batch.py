@@ -0,0 +1,248 @@
+"""This module provides functions for running DETOUR on many suites
+(jobs) at once. Each job is a dictionary with the keys
+"executed_filepath", "not_executed_filepath", "output_filepath",
+"functionality", "prioritization_ratio", "selection_min_ratio",
+"selection_max_ratio", "selection_m_closest_neighbor_count",
+"selection_w_selection_threshold", "road_section_count", "distance_backend"
+and "random_seed", or only the keys "output_filepath" (possibly None) and
+"error" for a job whose manifest entry is invalid, which then fails.
+All jobs share one process pool. Features of roads that appear in
+several jobs are extracted only once, and jobs are scheduled
+largest suite first. Worker processes read the roads of their job
+from the job's files, so that only filepaths and features are sent
+to them."""
+
+import concurrent.futures as fut
+import json
+import time
+
+from . import clustering
+from . import detour
+from . import features
+from . import planning
+from .road import get_roads_from_json_filepath
+
+
+def extract_road_features(road_section_count, xvalues, yvalues):
+    """Extract curvature based features of a single road. This function
+    is executed in the worker processes of the pool. It returns None if
+    extraction fails, so that the failure is left to (and reported by)
+    the jobs that contain the road rather than stopping the batch."""
+    feature_extractor = features.CurvatureBasedRoadFeatureExtractor(road_section_count)
+    try:
+        return feature_extractor.extract_features(xvalues, yvalues)
+    except Exception:
+        return None
+
+
+def get_job_label(job):
+    """Return the label of a job in printed messages: its output filepath, if any."""
+    if job["output_filepath"] is None:
+        return "(job without output filepath)"
+    return job["output_filepath"]
+
+
+def get_job_roads(job):
+    """Return the executed and not-executed roads of a job, read from its
+    files. Raise ValueError with the job's error if the job is invalid."""
+    if "error" in job:
+        raise ValueError(job["error"])
+    return (get_roads_from_json_filepath(job["executed_filepath"], True),
+            get_roads_from_json_filepath(job["not_executed_filepath"], False))
+
+
+def get_job_road_keys(jobs):
+    """Read the roads of all jobs and return, for each job, the list of
+    keys (see CachedRoadFeatureExtractor.get_road_key) of its roads, or
+    the exception raised while reading its files. Keys of roads that
+    appear in several jobs are shared rather than copied."""
+    shared_keys = {}
+    job_road_keys = []
+    for job in jobs:
+        try:
+            executed_roads, not_executed_roads = get_job_roads(job)
+        except Exception as exc:
+            job_road_keys.append(exc)
+            continue
+        keys = []
+        for road_ob in executed_roads + not_executed_roads:
+            key = features.CachedRoadFeatureExtractor.get_road_key(road_ob.xvalues, road_ob.yvalues)
+            keys.append(shared_keys.setdefault(key, key))
+        job_road_keys.append(keys)
+    return job_road_keys
+
+
+def build_feature_caches(jobs, job_road_keys, executor, chunksize=8):
+    """Extract the features of all distinct roads of the given jobs
+    (with keys given by job_road_keys) in the processes of executor and
+    return a dictionary that maps each road section count to a feature
+    cache for CachedRoadFeatureExtractor."""
+    pending = {}
+    for job, keys in zip(jobs, job_road_keys):
+        if isinstance(keys, Exception):
+            continue
+        section_keys = pending.setdefault(job["road_section_count"], {})
+        for key in keys:
+            section_keys[key] = None
+
+    caches = {}
+    for road_section_count, section_keys in pending.items():
+        features_list = executor.map(extract_road_features,
+                                     [road_section_count] * len(section_keys),
+                                     [key[0] for key in section_keys],
+                                     [key[1] for key in section_keys],
+                                     chunksize=chunksize)
+        caches[road_section_count] = {key: road_features
+                                      for key, road_features in zip(section_keys, features_list)
+                                      if road_features is not None}
+    return caches
+
+
+def get_worker_count(worker_count):
+    """Return the number of pool processes for the given worker_count:
+    worker_count itself, or the number of available processors if None."""
+    return worker_count or planning.get_cpu_count()
+
+
+def get_job_resources(job_count, worker_count, memory_limit_bytes):
+    """Return the memory limit (None if memory_limit_bytes is None) and the
+    number of distance threads of each job, when job_count jobs share a
+    pool of worker_count processes (see get_worker_count)."""
+    cpu_count = planning.get_cpu_count()
+    concurrent_job_count = max([1, min([job_count, worker_count])])
+    thread_count = max([1, cpu_count // concurrent_job_count])
+    if memory_limit_bytes is None:
+        return None, thread_count
+    return memory_limit_bytes // concurrent_job_count, thread_count
+
+
+def get_job_plan(job, executed_roads, not_executed_roads, memory_limit_bytes, thread_count):
+    """Return the plan (see planning.make_plan) of a job. Features of
+    batch jobs are extracted by the shared pool, so jobs extract serially."""
+    roads = executed_roads + not_executed_roads
+    selection_count = planning.get_selection_count(roads,
+                                                   job["functionality"],
+                                                   job["prioritization_ratio"],
+                                                   job["selection_max_ratio"])
+    return planning.make_plan(roads,
+                              job["road_section_count"],
+                              selection_count,
+                              memory_limit_bytes,
+                              1,
+                              job["distance_backend"],
+                              thread_count)
+
+
+def run_job(job, feature_cache, memory_limit_bytes=None, thread_count=None):
+    """Run DETOUR prioritization/selection for a single job within the
+    given memory limit and number of distance threads, write the ids of
+    the output roads to the job's output file and return the time
+    (in seconds) spent on the job."""
+    start_time = time.perf_counter()
+    executed_roads, not_executed_roads = get_job_roads(job)
+
+    plan = get_job_plan(job, executed_roads, not_executed_roads, memory_limit_bytes, thread_count)
+    if not plan["fits_in_memory"]:
+        raise MemoryError("job is not expected to fit within its memory limit of "
+                          + planning.format_bytes(memory_limit_bytes))
+
+    feature_extractor = features.CachedRoadFeatureExtractor(
+        features.CurvatureBasedRoadFeatureExtractor(job["road_section_count"]), feature_cache)
+    road_clusterer = clustering.RoadClusterer(feature_extractor,
+                                              plan["distance_backend"],
+                                              plan["distance_storage"],
+                                              plan["extraction_worker_count"],
+                                              plan["distance_block_size"],
+                                              plan["distance_thread_count"])
+
+    detour_ob = detour.DETOUR(executed_roads, not_executed_roads, road_clusterer, job["random_seed"])
+
+    if job["functionality"] == 'prioritization':
+        output_roads = detour_ob.prioritize(job["prioritization_ratio"])
+    else:
+        output_roads = detour_ob.select(job["selection_min_ratio"],
+                                        job["selection_max_ratio"],
+                                        job["selection_m_closest_neighbor_count"],
+                                        job["selection_w_selection_threshold"])
+
+    output_data = [road_ob.id for road_ob in output_roads]
+    with open(job["output_filepath"], 'w') as file:
+        json.dump(output_data, file, indent=4)
+
+    return time.perf_counter() - start_time
+
+
+def plan_batch(jobs, worker_count=None, memory_limit_bytes=None):
+    """Print the plan of each job, as run_batch would plan it, without
+    running any job. Return the list of plans (None for jobs whose files
+    could not be read), in the order of the given jobs."""
+    worker_count = get_worker_count(worker_count)
+    job_memory_limit_bytes, thread_count = get_job_resources(len(jobs), worker_count, memory_limit_bytes)
+    plans = []
+    for job in jobs:
+        try:
+            executed_roads, not_executed_roads = get_job_roads(job)
+        except Exception as exc:
+            print(f"{get_job_label(job)}: failed ({exc})")
+            plans.append(None)
+            continue
+        plan = get_job_plan(job, executed_roads, not_executed_roads, job_memory_limit_bytes, thread_count)
+        print(f"{get_job_label(job)}:")
+        print(planning.format_plan(plan))
+        plans.append(plan)
+    return plans
+
+
+def run_batch(jobs, worker_count=None, memory_limit_bytes=None):
+    """Run all given jobs on a pool of worker_count processes (all
+    available processors if None), with memory_limit_bytes (no limit if
+    None) and the processors shared by the jobs that run at the same time.
+    Features of distinct roads are extracted first, then jobs are
+    submitted in decreasing order of their road counts. A job that fails
+    (e.g., because it does not fit within its memory limit) does not stop
+    the others.
+    Return a report dictionary with the time spent on shared feature
+    extraction and one entry (output filepath, road count and time in
+    seconds, or the error of a failed job) per job, in the order of
+    the given jobs."""
+    reports = [{"output_filepath": job["output_filepath"]} for job in jobs]
+    # The same count sizes the pool and divides the memory limit between concurrent jobs
+    worker_count = get_worker_count(worker_count)
+    job_memory_limit_bytes, thread_count = get_job_resources(len(jobs), worker_count, memory_limit_bytes)
+    with fut.ProcessPoolExecutor(max_workers=worker_count) as executor:
+        start_time = time.perf_counter()
+        job_road_keys = get_job_road_keys(jobs)
+        feature_caches = build_feature_caches(jobs, job_road_keys, executor)
+        feature_extraction_seconds = time.perf_counter() - start_time
+
+        for i, keys in enumerate(job_road_keys):
+            if isinstance(keys, Exception):
+                reports[i]["error"] = str(keys)
+                print(f"{get_job_label(jobs[i])}: failed ({keys})")
+            else:
+                reports[i]["road_count"] = len(keys)
+
+        order = sorted([i for i in range(len(jobs)) if "error" not in reports[i]],
+                       key=lambda i: reports[i]["road_count"], reverse=True)
+        futures = {}
+        for i in order:
+            feature_cache = feature_caches[jobs[i]["road_section_count"]]
+            job_cache = {key: feature_cache[key] for key in job_road_keys[i] if key in feature_cache}
+            futures[executor.submit(run_job, jobs[i], job_cache, job_memory_limit_bytes, thread_count)] = i
+        # Roads are only needed by the workers from here on
+        del job_road_keys, feature_caches
+
+        for future in fut.as_completed(futures):
+            i = futures[future]
+            try:
+                reports[i]["seconds"] = future.result()
+            except Exception as exc:
+                reports[i]["error"] = str(exc)
+                print(f"{get_job_label(jobs[i])}: failed ({exc})")
+                continue
+            print(f"{reports[i]['output_filepath']}: {reports[i]['road_count']} roads, "
+                  f"{reports[i]['seconds']:.3f} s")
+
+    print(f"Feature extraction for all jobs: {feature_extraction_seconds:.3f} s")
+    return {"feature_extraction_seconds": feature_extraction_seconds,
+            "jobs": reports}
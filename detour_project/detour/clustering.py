@@ -1,15 +1,82 @@
+import concurrent.futures as fut
+import tempfile
+
 import numpy as np
 from scipy.cluster.hierarchy import linkage, to_tree
 from scipy.spatial.distance import pdist
+from threadpoolctl import threadpool_limits
 
 from . import features
+from . import planning
+
+# Absolute tolerance of gram_pdist with respect to pdist, relative to the
+# largest norm of (column-centered) data points. Squared distances obtained
+# through the Gram-matrix identity carry a rounding error of the order of
+# machine epsilon times the squared norms, which becomes an error of the
+# order of the square root of machine epsilon for (nearly) equal points.
+GRAM_PDIST_TOLERANCE = 1e-7
+
+
+def gram_pdist(data, out=None, block_size=256, thread_count=None):
+    """Compute pairwise Euclidean distances between the rows of data
+    in the vector form returned by scipy.spatial.distance.pdist.
+
+    Distances are computed in blocks of block_size rows through the
+    identity |x - y|^2 = |x|^2 + |y|^2 - 2 x.y, where the inner products
+    are obtained by BLAS matrix multiplication. Blocks are processed by
+    thread_count threads (number of available processors if None), each running a
+    single-threaded BLAS so that cores are not oversubscribed, and written
+    directly into out, which can be any writable float64 array of size
+    n * (n - 1) / 2 (e.g., a numpy.memmap) and is allocated if None.
+    Negative squared distances caused by rounding are clamped to zero.
+    The result matches pdist within
+    GRAM_PDIST_TOLERANCE * max(1, largest norm of centered rows)."""
+    data = np.asarray(data, dtype=np.float64)
+    data = data - data.mean(axis=0)  # distances are invariant, rounding errors shrink
+    n = data.shape[0]
+    if out is None:
+        out = np.empty(n * (n - 1) // 2, dtype=np.float64)
+    squared_norms = np.einsum('ij,ij->i', data, data)
+
+    def compute_block(i0):
+        i1 = min(i0 + block_size, n)
+        squared_distances = data[i0:i1] @ data[i0:].T
+        squared_distances *= -2
+        squared_distances += squared_norms[i0:i1, None]
+        squared_distances += squared_norms[None, i0:]
+        np.maximum(squared_distances, 0, out=squared_distances)
+        np.sqrt(squared_distances, out=squared_distances)
+        for i in range(i0, i1):
+            # Offset of the distance between ith and (i+1)th objects (see DETOUR.get_distance)
+            start = n * i - (i * (i + 1)) // 2
+            out[start:start + n - i - 1] = squared_distances[i - i0, i - i0 + 1:]
+
+    with threadpool_limits(limits=1, user_api='blas'), \
+            fut.ThreadPoolExecutor(max_workers=thread_count or planning.get_cpu_count()) as executor:
+        # list() propagates exceptions raised in the threads
+        list(executor.map(compute_block, range(0, n, block_size)))
+
+    return out
+
 
 class HierarchicalClusterer:
     """This class implements Hierarchical Clustering for
     data points represented by their features."""
 
-    def __init__(self, distance_calculation_method='ward'):
+    def __init__(self, distance_calculation_method='ward', distance_backend='pdist', distance_storage='memory',
+                 distance_block_size=256, distance_thread_count=None):
+        """distance_backend selects how pairwise distances are computed:
+        'pdist' uses scipy.spatial.distance.pdist, 'gram' uses the
+        multithreaded gram_pdist (with distance_block_size and
+        distance_thread_count as its block_size and thread_count).
+        distance_storage selects where the distance vector is kept:
+        'memory' or 'memmap' (a temporary file filled in chunks by
+        gram_pdist, regardless of distance_backend)."""
         self.distance_calculation_method = distance_calculation_method
+        self.distance_backend = distance_backend
+        self.distance_storage = distance_storage
+        self.distance_block_size = distance_block_size
+        self.distance_thread_count = distance_thread_count
 
     def cluster(self, features_list):
         """Given a list of feature lists, use hierarchical
@@ -17,7 +84,14 @@ class HierarchicalClusterer:
         return its root as well as the distance matrix showing
         pairwise distances between nodes in vector form."""
         data = np.vstack(features_list)
-        dist = pdist(data)
+        if self.distance_storage == 'memmap':
+            n = data.shape[0]
+            dist = np.memmap(tempfile.TemporaryFile(), dtype=np.float64, mode='w+', shape=(n * (n - 1) // 2,))
+            gram_pdist(data, out=dist, block_size=self.distance_block_size, thread_count=self.distance_thread_count)
+        elif self.distance_backend == 'gram':
+            dist = gram_pdist(data, block_size=self.distance_block_size, thread_count=self.distance_thread_count)
+        else:
+            dist = pdist(data)
         Z = linkage(dist, method=self.distance_calculation_method)
         return to_tree(Z), dist
 
@@ -26,16 +100,51 @@ class RoadClusterer(HierarchicalClusterer):
     """This class implements Hierarchical Clustering for Road
     objects based on their features."""
 
-    def __init__(self, road_feature_extractor):
+    def __init__(self, road_feature_extractor, distance_backend='pdist', distance_storage='memory',
+                 extraction_worker_count=1, distance_block_size=256, distance_thread_count=None):
         """road_feature_extractor is a FeatureExtractor object
-        that implements extract_features method."""
-        super().__init__(distance_calculation_method='ward')
+        that implements extract_features method. When extraction_worker_count
+        is larger than 1, features are extracted on that many processes."""
+        super().__init__(distance_calculation_method='ward',
+                         distance_backend=distance_backend,
+                         distance_storage=distance_storage,
+                         distance_block_size=distance_block_size,
+                         distance_thread_count=distance_thread_count)
         self.road_feature_extractor = road_feature_extractor
+        self.extraction_worker_count = extraction_worker_count
+
+    def extract_features_in_parallel(self, road_feature_extractor, roads):
+        """Extract features of the given roads with road_feature_extractor
+        on extraction_worker_count processes and return them as a list."""
+        if len(roads) == 0:
+            return []
+        with fut.ProcessPoolExecutor(max_workers=self.extraction_worker_count) as executor:
+            chunksize = max([1, len(roads) // (4 * self.extraction_worker_count)])
+            return list(executor.map(road_feature_extractor.extract_features,
+                                     [road.xvalues for road in roads],
+                                     [road.yvalues for road in roads],
+                                     chunksize=chunksize))
 
     def cluster(self, roads):
         """Given a list of roads, and a feature_extractor use hierarchical
         clustering to obtain a tree structure (dendogram) and
         return its root as well as the distance matrix showing
         pairwise distances between nodes in vector form."""
-        features_list = [self.road_feature_extractor.extract_features(road.xvalues, road.yvalues) for road in roads]
+        extractor = self.road_feature_extractor
+        if self.extraction_worker_count > 1 and isinstance(extractor, features.CachedRoadFeatureExtractor):
+            # Only cache misses are sent to the workers, with the wrapped extractor so that
+            # the cache itself is not copied into them, and their features are merged back
+            keys = [extractor.get_road_key(road.xvalues, road.yvalues) for road in roads]
+            missing_roads = {}
+            for key, road in zip(keys, roads):
+                if key not in extractor.cache:
+                    missing_roads[key] = road
+            missing_features_list = self.extract_features_in_parallel(extractor.road_feature_extractor,
+                                                                      list(missing_roads.values()))
+            extractor.cache.update(zip(missing_roads.keys(), missing_features_list))
+            features_list = [extractor.cache[key] for key in keys]
+        elif self.extraction_worker_count > 1:
+            features_list = self.extract_features_in_parallel(extractor, roads)
+        else:
+            features_list = [extractor.extract_features(road.xvalues, road.yvalues) for road in roads]
         return super().cluster(features_list)
@@ -98,3 +98,29 @@ class CurvatureBasedRoadFeatureExtractor(RoadFeatureExtractor):
         klist, alist = CurvatureBasedRoadFeatureExtractor.reduce(k, a, self.road_section_count)
         return [t0] + klist + alist
 
+
+class CachedRoadFeatureExtractor(RoadFeatureExtractor):
+    """This class wraps a RoadFeatureExtractor and memoizes its
+    features by road coordinates, so that a road that appears
+    more than once (e.g., in several suites) is processed only once."""
+
+    def __init__(self, road_feature_extractor, cache=None):
+        """road_feature_extractor is the RoadFeatureExtractor whose
+        results are cached. cache is an optional dictionary mapping
+        road keys (see get_road_key) to already extracted features."""
+        super().__init__()
+        self.road_feature_extractor = road_feature_extractor
+        self.cache = {} if cache is None else cache
+
+    @staticmethod
+    def get_road_key(xvalues, yvalues):
+        """Return a hashable key identifying a road by its coordinates."""
+        return tuple(xvalues), tuple(yvalues)
+
+    def extract_features(self, xvalues, yvalues):
+        """Return cached features of the road if available, otherwise
+        extract them with the wrapped extractor and cache them."""
+        key = CachedRoadFeatureExtractor.get_road_key(xvalues, yvalues)
+        if key not in self.cache:
+            self.cache[key] = self.road_feature_extractor.extract_features(xvalues, yvalues)
+        return self.cache[key]
@@ -0,0 +1,217 @@
+"""This module provides functions for planning a DETOUR run before
+any feature is extracted. Based on the number of roads and road points,
+the memory needed for the condensed distance vector and the dendrogram,
+and the time needed for feature extraction (reduce), hierarchical
+clustering (linkage) and the retrieve loop are estimated. From these
+estimates, a plan chooses in-memory or memory-mapped storage of the
+distance vector, the block size and threads of the 'gram' distance
+backend, and serial or parallel feature extraction, within a given
+memory limit.
+
+Estimates are coarse and derived from measurements of the reference
+implementation; they are meant to tell apart runs that take seconds
+from runs that take hours, and runs that fit in memory from those
+that do not."""
+
+import os
+
+# Memory estimates in bytes
+FLOAT_BYTES = 8
+ROAD_POINT_BYTES = 200  # json entry of a point together with its x and y values
+TREE_NODE_BYTES = 400  # scipy ClusterNode with the attributes added by treeutils
+WORKER_PROCESS_BYTES = 100 * 2 ** 20  # interpreter with numpy and scipy imported, per process
+
+# Time estimates in seconds
+REDUCE_SECONDS_PER_STEP = 1.5e-6  # per merge step and road section in reduce
+DISTANCE_SECONDS_PER_ENTRY = 2e-9  # per pair of roads and feature
+LINKAGE_SECONDS_PER_PAIR = 2.5e-8  # per (road count)^2 in ward linkage
+RETRIEVE_SECONDS_PER_ROAD = 5e-7  # per selected road and road in the retrieve loop
+
+# Feature extraction is parallelized only when it is expected to take longer than this
+PARALLEL_EXTRACTION_MIN_SECONDS = 2.0
+
+# Rows per block of gram_pdist when memory allows, and the smallest block
+# size worth keeping before the number of threads is reduced instead
+GRAM_BLOCK_SIZE = 256
+GRAM_MIN_BLOCK_SIZE = 16
+
+# Memory limits of the cgroup (container) of the process, for cgroup v2 and v1
+CGROUP_MEMORY_LIMIT_FILEPATHS = ["/sys/fs/cgroup/memory.max",
+                                 "/sys/fs/cgroup/memory/memory.limit_in_bytes"]
+
+
+def get_memory_limit_bytes():
+    """Return the memory available to the process in bytes, that is, the
+    smaller of the physical memory of the machine and the memory limit of
+    the cgroup (container) of the process, or None if neither can be
+    determined on this platform."""
+    limits = []
+    try:
+        limits.append(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE'))
+    except (AttributeError, ValueError, OSError):
+        pass
+    for filepath in CGROUP_MEMORY_LIMIT_FILEPATHS:
+        try:
+            with open(filepath, 'r') as file:
+                value = file.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():  # "max" means no limit in cgroup v2
+            limits.append(int(value))
+    if len(limits) == 0:
+        return None
+    return min(limits)
+
+
+def get_cpu_count():
+    """Return the number of processors available to the process."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def choose_gram_blocks(road_count, available_bytes, thread_count):
+    """Return the block size and the number of threads of gram_pdist such
+    that the block buffers (thread_count * block_size * road_count floats)
+    fit in available_bytes. Blocks of GRAM_BLOCK_SIZE rows on thread_count
+    threads are preferred; the block size is reduced first and the number
+    of threads once blocks would become smaller than GRAM_MIN_BLOCK_SIZE."""
+    row_bytes = max([1, road_count]) * FLOAT_BYTES
+    block_size = min([GRAM_BLOCK_SIZE, available_bytes // (thread_count * row_bytes)])
+    if block_size < GRAM_MIN_BLOCK_SIZE:
+        thread_count = min([thread_count, max([1, available_bytes // (GRAM_MIN_BLOCK_SIZE * row_bytes)])])
+        block_size = min([GRAM_MIN_BLOCK_SIZE, available_bytes // (thread_count * row_bytes)])
+    return int(max([1, block_size])), int(thread_count)
+
+
+def get_selection_count(roads, functionality, prioritization_ratio, selection_max_ratio):
+    """Return the largest number of roads that the retrieve loop may select."""
+    selectable_count = len([road_ob for road_ob in roads if road_ob.is_selectable])
+    if functionality == 'prioritization':
+        ratio = prioritization_ratio
+    else:
+        ratio = selection_max_ratio
+    return max([1, int(ratio * selectable_count)])
+
+
+def make_plan(roads,
+              road_section_count,
+              selection_count,
+              memory_limit_bytes=None,
+              worker_count=None,
+              distance_backend='pdist',
+              thread_count=None):
+    """Estimate memory and time of a DETOUR run on the given roads and
+    return a plan as a dictionary. The plan keeps the distance vector in
+    memory when the estimated peak memory stays within memory_limit_bytes
+    (no limit if None) and otherwise memory-maps it to a temporary file,
+    which requires the chunked 'gram' distance backend. For the 'gram'
+    backend, the plan chooses a block size and up to thread_count threads
+    whose block buffers fit in memory. Feature extraction is done on
+    worker_count processes when it is expected to be slow and the extra
+    processes fit in memory. Both counts default to, and are capped at,
+    the number of available processors.
+    The key "fits_in_memory" is False if no plan fits the memory limit."""
+    road_count = len(roads)
+    point_count = sum([len(road_ob.xvalues) for road_ob in roads])
+    feature_count = 2 * road_section_count + 1
+    pair_count = road_count * (road_count - 1) // 2
+    cpu_count = get_cpu_count()
+    worker_count = cpu_count if worker_count is None else min([worker_count, cpu_count])
+    thread_count = cpu_count if thread_count is None else min([thread_count, cpu_count])
+
+    # reduce merges sections until road_section_count remain, each step scanning all sections
+    reduce_step_count = 0
+    for road_ob in roads:
+        kappa_count = len(road_ob.xvalues) - 2
+        reduce_step_count += max([0, kappa_count - road_section_count]) * kappa_count
+
+    road_bytes = point_count * ROAD_POINT_BYTES
+    feature_bytes = road_count * feature_count * FLOAT_BYTES
+    distance_bytes = pair_count * FLOAT_BYTES
+    # linkage works on its own copy of the distance vector and outputs a (road_count - 1) x 4 matrix
+    dendrogram_bytes = distance_bytes + 4 * max([0, road_count - 1]) * FLOAT_BYTES \
+        + (2 * road_count - 1) * TREE_NODE_BYTES
+
+    memory_limit = float('inf') if memory_limit_bytes is None else memory_limit_bytes
+    # the running process itself costs as much as an extra worker before any data is loaded
+    base_bytes = WORKER_PROCESS_BYTES + road_bytes + feature_bytes + dendrogram_bytes
+    # gram_pdist needs room for at least one row of distances
+    row_bytes = road_count * FLOAT_BYTES if distance_backend == 'gram' else 0
+    if base_bytes + distance_bytes + row_bytes <= memory_limit:
+        distance_storage = 'memory'
+        peak_bytes = base_bytes + distance_bytes
+    else:
+        # memory-mapped distances live in the page cache rather than in the process
+        distance_storage = 'memmap'
+        distance_backend = 'gram'
+        peak_bytes = base_bytes
+
+    distance_block_size = GRAM_BLOCK_SIZE
+    distance_thread_count = thread_count
+    if distance_backend == 'gram':
+        distance_block_size, distance_thread_count = choose_gram_blocks(road_count,
+                                                                        memory_limit - peak_bytes,
+                                                                        thread_count)
+        peak_bytes += distance_thread_count * distance_block_size * road_count * FLOAT_BYTES
+
+    reduce_seconds = reduce_step_count * REDUCE_SECONDS_PER_STEP
+    extraction_worker_count = 1
+    if worker_count > 1 and reduce_seconds > PARALLEL_EXTRACTION_MIN_SECONDS \
+            and peak_bytes + worker_count * WORKER_PROCESS_BYTES <= memory_limit:
+        extraction_worker_count = worker_count
+        peak_bytes += worker_count * WORKER_PROCESS_BYTES
+
+    return {"road_count": road_count,
+            "point_count": point_count,
+            "memory_limit_bytes": memory_limit_bytes,
+            "distance_bytes": distance_bytes,
+            "dendrogram_bytes": dendrogram_bytes,
+            "peak_bytes": peak_bytes,
+            "reduce_seconds": reduce_seconds / extraction_worker_count,
+            "distance_seconds": pair_count * feature_count * DISTANCE_SECONDS_PER_ENTRY,
+            "linkage_seconds": road_count ** 2 * LINKAGE_SECONDS_PER_PAIR,
+            "retrieve_seconds": selection_count * road_count * RETRIEVE_SECONDS_PER_ROAD,
+            "distance_storage": distance_storage,
+            "distance_backend": distance_backend,
+            "distance_block_size": distance_block_size,
+            "distance_thread_count": distance_thread_count,
+            "extraction_worker_count": extraction_worker_count,
+            "fits_in_memory": peak_bytes <= memory_limit}
+
+
+def format_bytes(byte_count):
+    """Return a human readable representation of a number of bytes."""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if byte_count < 1024:
+            return f"{byte_count:.1f} {unit}"
+        byte_count /= 1024
+    return f"{byte_count:.1f} TiB"
+
+
+def format_plan(plan):
+    """Return a human readable, multi-line description of a plan."""
+    if plan["memory_limit_bytes"] is None:
+        memory_limit = "none"
+    else:
+        memory_limit = format_bytes(plan["memory_limit_bytes"])
+    if plan["extraction_worker_count"] > 1:
+        extraction = f"parallel ({plan['extraction_worker_count']} processes)"
+    else:
+        extraction = "serial"
+    lines = [f"DETOUR plan for {plan['road_count']} roads with {plan['point_count']} points",
+             f"  distance vector:     {format_bytes(plan['distance_bytes'])}",
+             f"  dendrogram:          {format_bytes(plan['dendrogram_bytes'])}",
+             f"  estimated peak:      {format_bytes(plan['peak_bytes'])} (limit: {memory_limit})",
+             f"  reduce:              {plan['reduce_seconds']:.1f} s",
+             f"  distances:           {plan['distance_seconds']:.1f} s",
+             f"  linkage:             {plan['linkage_seconds']:.1f} s",
+             f"  retrieve loop:       {plan['retrieve_seconds']:.1f} s",
+             f"  distance storage:    {plan['distance_storage']} ({plan['distance_backend']} backend)",
+             f"  feature extraction:  {extraction}"]
+    if plan["distance_backend"] == 'gram':
+        lines.insert(-1, f"  distance blocks:     {plan['distance_block_size']} rows on "
+                         f"{plan['distance_thread_count']} threads")
+    if not plan["fits_in_memory"]:
+        lines.append("  the run is not expected to fit within the memory limit")
+    return "\n".join(lines)
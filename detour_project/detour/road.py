@@ -7,6 +7,9 @@ Roads can be Oracle (executed tests) or Non-Oracle (not-executed tests).
 Oracle, Failing: is_failing=True/False, is_selectable=False
 Non-Oracle: is_failing=False/None, is_selectable=True"""
 
+import json
+
+
 class Road:
     def __init__(self, id,
                        xvalues,
@@ -17,4 +20,46 @@ class Road:
         self.xvalues = xvalues
         self.yvalues = yvalues
         self.is_failing = is_failing
-        self.is_selectable = is_selectable
\ No newline at end of file
+        self.is_selectable = is_selectable
+
+
+def get_roads_from_json_filepath(json_filepath, is_executed):
+    """This function creates a list of Road objects
+    from roads specified in a json file. The json file has the template
+    [road1_spec, road2_spec, ...] where road1_spec has the template
+    {"meta_data": {"test_info": {"test_outcome": "FAIL"}}
+     "road_points" [{"x": float, "y": float}, ...]} for Failing executed-tests
+    {"meta_data": {"test_info": {"test_outcome": "PASS"}}
+     "road_points" [{"x": float, "y": float}, ...]} for Passing executed-tests
+    {"road_points" [{"x": float, "y": float}, ...]} for not-executed-tests
+    It is allowable to have other keys such as ids and information about
+    test-execution configurations as long as the keys above are provided.
+    The parameter is_executed (True/False) specifies whether the provided
+    json file contains roads that are executed or not-executed. Executed
+    roads (tests) should have the test_outcome.
+     """
+    roads = []
+    with open(json_filepath, 'r') as file:
+        data = json.load(file)
+        for entry in data:
+            xvalues = [point["x"] for point in entry["road_points"]]
+            yvalues = [point["y"] for point in entry["road_points"]]
+            if is_executed:
+                is_failing = entry["meta_data"]["test_info"]["test_outcome"] == "FAIL"
+                is_selectable = False
+                road_to_add = Road(entry,
+                                   xvalues,
+                                   yvalues,
+                                   is_failing,
+                                   is_selectable)
+            else:
+                is_failing = None
+                is_selectable = True
+                road_to_add = Road(entry,
+                                   xvalues,
+                                   yvalues,
+                                   is_failing,
+                                   is_selectable)
+            roads.append(road_to_add)
+
+    return roads